@@ -3,12 +3,30 @@ import argparse
 import math
 import time
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
 from perfetto.trace_processor import TraceProcessor, TraceProcessorConfig
 
 from tqdm import tqdm  # Ensure tqdm is installed
 
 
+def factorize_cpus(ucpu: pd.Series):
+    """
+    Map every slice to the index of its CPU in the sorted list of CPUs.
+
+    Parameters:
+    - ucpu (pd.Series): CPU of every running slice.
+
+    Returns:
+    - tuple: (cpu_idx, cpu_list), the per-slice CPU index and the sorted unique CPUs.
+    """
+    cpu_idx, cpu_list = pd.factorize(ucpu, sort=True)
+    if (cpu_idx < 0).any():
+        raise ValueError("Running slices without a CPU found in the data.")
+    return cpu_idx, cpu_list
+
+
 def calculate_cpu_load_sliding_window_base(
     df: pd.DataFrame,
     window_size_ns: int,
@@ -16,17 +34,21 @@ def calculate_cpu_load_sliding_window_base(
     num_cpus=None,
     per_core=False,
     progress_bar=None,
+    cpu_idx=None,
+    cpu_list=None,
 ):
     """
     Calculate CPU load using a sliding window approach.
 
     Parameters:
-    - df (pd.DataFrame): DataFrame containing running slices with columns ['ts_ns', 'dur', 'ucpu']
+    - df (pd.DataFrame): DataFrame containing running slices with columns ['ts_ns', 'ts_end_ns', 'ucpu']
     - window_size_ns (int): Size of the window in nanoseconds.
     - window_move_ns (int): Step size to move the window in nanoseconds.
     - num_cpus (int): Number of unique CPU cores (required if per_core is False).
     - per_core (bool): Whether to calculate per-core CPU load.
     - progress_bar (tqdm.tqdm): Progress bar instance.
+    - cpu_idx (np.ndarray): Per-slice CPU index from factorize_cpus (computed if not given).
+    - cpu_list (pd.Index): Sorted unique CPUs from factorize_cpus (computed if not given).
 
     Returns:
     - pd.DataFrame: DataFrame with window start time (ms) and CPU load percentage.
@@ -42,75 +64,102 @@ def calculate_cpu_load_sliding_window_base(
     num_windows = (
         int(math.ceil((total_duration_ns - window_size_ns) / window_move_ns)) + 1
     ) - 4       # Last 4 windows are not accurate
-    window_start_ns = [i * window_move_ns for i in range(num_windows)]
-
-    # Initialize list to store CPU load per window
-    cpu_loads = []
-
-    def calculate_load_percentage(slice_df, start_ns, end_ns, num_cpus):
-        overlapping = slice_df[
-            (slice_df["ts_ns"] < end_ns)
-            & (slice_df["ts_end_ns"] > start_ns)
-        ]
-        if overlapping.empty:
-            return 0
-        else:
-            overlapping = overlapping.copy()
-            overlapping["effective_start_ns"] = overlapping["ts_ns"].clip(
-                lower=start_ns
-            )
-            overlapping["effective_end_ns"] = (
-                overlapping["ts_end_ns"]
-            ).clip(upper=end_ns)
-            overlapping["overlap_ns"] = (
-                overlapping["effective_end_ns"] - overlapping["effective_start_ns"]
-            )
-            overlapping["overlap_ns"] = overlapping["overlap_ns"].clip(lower=0)
-            total_running_ns = overlapping["overlap_ns"].sum()
+    # Short traces or large windows leave no accurate window at all
+    num_windows = max(num_windows, 0)
+    window_start_ns = np.arange(num_windows, dtype=np.int64) * window_move_ns
+    window_start_ms = window_start_ns / 1_000_000
+
+    def running_ns_cdf(ts, te):
+        # Running time is a piecewise linear function of time whose slope is the
+        # number of slices running at that moment. Build its breakpoints once so
+        # any window can be answered with two lookups.
+        valid = te > ts
+        times = np.concatenate([ts[valid], te[valid]])
+        deltas = np.repeat(np.array([1, -1], dtype=np.int64), valid.sum())
+        order = np.argsort(times, kind="stable")
+        times, deltas = times[order], deltas[order]
+        running = np.cumsum(deltas)
+        cumulative = np.zeros_like(times)
+        np.cumsum(running[:-1] * np.diff(times), out=cumulative[1:])
+        return times, running, cumulative
+
+    def running_ns_at(cdf, points_ns):
+        times, running, cumulative = cdf
+        if times.size == 0:
+            return np.zeros_like(points_ns)
+        k = np.searchsorted(times, points_ns, side="right") - 1
+        kc = k.clip(min=0)
+        return np.where(
+            k >= 0, cumulative[kc] + running[kc] * (points_ns - times[kc]), 0
+        )
+
+    def calculate_load_percentage(slices, num_cpus):
+        cdf = running_ns_cdf(*slices)
+        total_running_ns = running_ns_at(
+            cdf, window_start_ns + window_size_ns
+        ) - running_ns_at(cdf, window_start_ns)
         cpu_load_percentage = (total_running_ns / (num_cpus * window_size_ns)) * 100
-        cpu_load_percentage = min(cpu_load_percentage, 100.0)
-        return cpu_load_percentage
+        return np.minimum(cpu_load_percentage, 100.0)
 
-    if per_core:
-        cpu_list = sorted(df["ucpu"].unique())
-        for ucpu in cpu_list:
-            if progress_bar:
-                window_iter = tqdm(
-                    window_start_ns, desc=f"Calculating CPU {ucpu} Load", unit="win"
-                )
-            else:
-                window_iter = window_start_ns
-            for start_ns in window_iter:
-                end_ns = start_ns + window_size_ns
-                cpu_slices = df[df["ucpu"] == ucpu]
-
-                cpu_load_percentage = calculate_load_percentage(
-                    cpu_slices, start_ns, end_ns, 1
-                )
+    ts = df["ts_ns"].to_numpy(np.int64)
+    te = df["ts_end_ns"].to_numpy(np.int64)
 
-                cpu_loads.append(
-                    {
-                        "window_start_ms": start_ns / 1_000_000,
-                        "ucpu": ucpu,
-                        "cpu_load_percentage": cpu_load_percentage,
-                    }
-                )
-    else:
+    if per_core:
+        if cpu_idx is None or cpu_list is None:
+            cpu_idx, cpu_list = factorize_cpus(df["ucpu"])
+        # Group slices by CPU once instead of masking the whole trace per core
+        order = np.argsort(cpu_idx, kind="stable")
+        bounds = np.cumsum(np.bincount(cpu_idx))[:-1]
+        cpu_slices = zip(np.split(ts[order], bounds), np.split(te[order], bounds))
         if progress_bar:
-            window_iter = tqdm(window_start_ns, desc="Calculating CPU Load", unit="win")
-        else:
-            window_iter = window_start_ns
-        for start_ns in window_iter:
-            end_ns = start_ns + window_size_ns
-            cpu_load_percentage = calculate_load_percentage(df, start_ns, end_ns, num_cpus)
-            cpu_loads.append(
-                {
-                    "window_start_ms": start_ns / 1_000_000,
-                    "cpu_load_percentage": cpu_load_percentage,
-                }
+            cpu_slices = tqdm(
+                cpu_slices,
+                total=len(cpu_list),
+                desc="Calculating per-CPU Load",
+                unit="cpu",
             )
 
-    cpu_load_df = pd.DataFrame(cpu_loads)
+        # Preallocate the load of every (core, window) pair and fill it per core
+        cpu_loads = np.empty((len(cpu_list), num_windows), dtype=np.float64)
+        for i, slices in enumerate(cpu_slices):
+            cpu_loads[i] = calculate_load_percentage(slices, 1)
+
+        cpu_load_df = pd.DataFrame(
+            {
+                "window_start_ms": np.tile(window_start_ms, len(cpu_list)),
+                "ucpu": np.repeat(cpu_list, num_windows),
+                "cpu_load_percentage": cpu_loads.ravel(),
+            }
+        )
+    else:
+        cpu_load_df = pd.DataFrame(
+            {
+                "window_start_ms": window_start_ms,
+                "cpu_load_percentage": calculate_load_percentage((ts, te), num_cpus),
+            }
+        )
+
+    return cpu_load_df
+
+
+def overall_cpu_load(cpu_load_per_core_df: pd.DataFrame, num_cpus: int):
+    """
+    Average per-core CPU loads into the overall CPU load of every window.
+
+    This matches calculate_cpu_load_sliding_window_base with per_core=False as
+    long as no core runs above 100%, i.e. a core never runs overlapping slices.
+
+    Parameters:
+    - cpu_load_per_core_df (pd.DataFrame): Per-core load from calculate_cpu_load_sliding_window_base.
+    - num_cpus (int): Number of unique CPU cores.
+
+    Returns:
+    - pd.DataFrame: DataFrame with window start time (ms) and CPU load percentage.
+    """
+    cpu_load_df = cpu_load_per_core_df.groupby(
+        "window_start_ms", as_index=False, sort=False
+    )["cpu_load_percentage"].sum()
+    cpu_load_df["cpu_load_percentage"] /= num_cpus
     return cpu_load_df
 
 
@@ -134,6 +183,74 @@ def calculate_dynamic_window_params(total_duration_ns, desired_points=200):
     return int(window_size_ns), int(window_move_ns)
 
 
+RUNNING_SLICES_SCHEMA = pa.schema(
+    [("ts_ns", pa.int64()), ("ts_end_ns", pa.int64()), ("ucpu", pa.int64())]
+)
+
+
+def query_as_arrow(processor, query, schema):
+    """
+    Read the rows of a trace processor query into a pyarrow Table.
+
+    Columns are stored as typed Arrow arrays (e.g. int64) rather than the
+    object-dtype columns produced by as_pandas_dataframe(). Each column is
+    sliced straight out of the query iterator's cells, no Row per result.
+
+    Parameters:
+    - processor (TraceProcessor): Trace processor to run the query on.
+    - query (str): SQL query to execute.
+    - schema (pa.Schema): Columns to read from the result and their types.
+
+    Returns:
+    - pa.Table: Query result.
+    """
+    result = processor.query(query)
+    # cells holds the result row-major, so column i is every column_count-th cell
+    columns = {
+        field.name: pa.array(
+            result.cells[result.column_names.index(field.name)::result.column_count],
+            type=field.type,
+        )
+        for field in schema
+    }
+    return pa.table(columns, schema=schema)
+
+
+def query_running_slices(trace_path, binary_path, sql_path):
+    """
+    Load a trace into the trace processor and query its running thread slices.
+
+    Parameters:
+    - trace_path (str): Path to the trace file.
+    - binary_path (str): Path to the trace processor binary.
+    - sql_path (str): Path to the running slices SQL query.
+
+    Returns:
+    - pa.Table: Running slices with columns ['ts_ns', 'ts_end_ns', 'ucpu'].
+    """
+    # Initialize TraceProcessor
+    config = TraceProcessorConfig(bin_path=binary_path)
+    try:
+        print('Loading trace...')
+        processor = TraceProcessor(trace=trace_path, config=config)
+    except Exception as e:
+        raise RuntimeError(f"Failed to initialize TraceProcessor: {e}")
+
+    with open(sql_path, "r") as f:
+        query = f.read()
+
+    # Execute the query into an Arrow table
+    try:
+        table = query_as_arrow(processor, query, RUNNING_SLICES_SCHEMA)
+    except Exception as e:
+        processor.close()
+        raise RuntimeError(f"Failed to execute SQL query: {e}")
+
+    # Close the TraceProcessor
+    processor.close()
+    return table
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Calculate CPU load over time from a Perfetto trace file."
@@ -172,37 +289,56 @@ def main():
         type=str,
         default=None,
     )
+    parser.add_argument(
+        "--cache",
+        help="Cache the queried slices next to the trace as an Arrow file and reuse them on later runs (optional)",
+        action="store_true",
+    )
     args = parser.parse_args()
 
-    # Initialize TraceProcessor
-    config = TraceProcessorConfig(bin_path=args.binary)
-    try:
-        print('Loading trace...')
-        processor = TraceProcessor(trace=args.file, config=config)
-    except Exception as e:
-        raise RuntimeError(f"Failed to initialize TraceProcessor: {e}")
-
     sql_path = os.path.join(
         os.path.dirname(__file__), "sql", "thread_running_slices.sql"
     )
-    with open(sql_path, "r") as f:
-        query = f.read()
 
-    # Execute the query and convert to DataFrame
-    try:
-        df = processor.query(query).as_pandas_dataframe()
-    except Exception as e:
-        processor.close()
-        raise RuntimeError(f"Failed to execute SQL query: {e}")
+    # Reuse the slices cached by a previous run unless the trace or query changed
+    cache_path = args.file + ".running_slices.arrow"
+    use_cache = args.cache and os.path.exists(cache_path)
+    if use_cache:
+        use_cache = os.path.getmtime(cache_path) >= max(
+            os.path.getmtime(args.file), os.path.getmtime(sql_path)
+        )
+    table = None
+    if use_cache:
+        print(f"Loading cached running slices from {cache_path}...")
+        try:
+            table = pa.ipc.open_file(pa.memory_map(cache_path)).read_all()
+        except Exception as e:
+            print(f"Failed to read cached running slices, querying the trace: {e}")
+    if table is None:
+        table = query_running_slices(args.file, args.binary, sql_path)
+        if args.cache:
+            # Write beside the cache and move it into place once complete, so an
+            # interrupted run never leaves a truncated cache that looks fresh
+            tmp_path = cache_path + ".tmp"
+            try:
+                with pa.OSFile(tmp_path, "wb") as sink:
+                    with pa.ipc.new_file(sink, table.schema) as writer:
+                        writer.write_table(table)
+                os.replace(tmp_path, cache_path)
+                print(f"Running slices cached to {cache_path}")
+            except Exception as e:
+                print(f"Failed to cache running slices: {e}")
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+    df = table.to_pandas(split_blocks=True, self_destruct=True)
+    del table
 
     print("Queried data frame: ")
     print("  size: ", df.shape)
     print("  columns: ", df.columns)
     print("  head: ", df.head())
 
-    # Close the TraceProcessor
-    processor.close()
-
     # Validate necessary columns
     required_columns = {"ts_ns", "ts_end_ns", "ucpu"}
     if not required_columns.issubset(df.columns):
@@ -251,26 +387,14 @@ def main():
         window_move_ms = args.window_move_ms
 
     # Calculate number of CPUs
-    num_cpus = df["ucpu"].nunique()
+    cpu_idx, cpu_list = factorize_cpus(df["ucpu"])
+    num_cpus = len(cpu_list)
     if num_cpus == 0:
         raise ValueError("No CPUs found in the data.")
 
-    # Calculate overall CPU load using sliding window with progress bar
-    print("\nCalculating overall CPU load...")
-    start = time.time()
-    cpu_load_df = calculate_cpu_load_sliding_window_base(
-        df,
-        window_size_ns=window_size_ns,
-        window_move_ns=window_move_ns,
-        num_cpus=num_cpus,
-        per_core=False,
-        progress_bar=True,
-    )
-    print("Overall CPU Load Data Frame:")
-    print(cpu_load_df.head())
-
     # Calculate per-CPU load using sliding window with progress bar
     print("\nCalculating per-CPU load...")
+    start = time.time()
     cpu_load_per_core_df = calculate_cpu_load_sliding_window_base(
         df,
         window_size_ns=window_size_ns,
@@ -278,10 +402,16 @@ def main():
         num_cpus=num_cpus,
         per_core=True,
         progress_bar=True,
+        cpu_idx=cpu_idx,
+        cpu_list=cpu_list,
     )
     print("Per-CPU Load Data Frame:")
     print(cpu_load_per_core_df.head())
 
+    cpu_load_df = overall_cpu_load(cpu_load_per_core_df, num_cpus)
+    print("\nOverall CPU Load Data Frame:")
+    print(cpu_load_df.head())
+
     end = time.time()
     print(f'\nTime taken: {end - start:.2f} seconds')
 
@@ -310,6 +440,8 @@ def main():
     # Optionally, plot the CPU load curves
     try:
         import matplotlib.pyplot as plt
+        from matplotlib.collections import LineCollection
+        from matplotlib.lines import Line2D
 
         # Create a figure with two subplots
         fig, axs = plt.subplots(2, 1, figsize=(15, 12), sharex=True)
@@ -327,21 +459,35 @@ def main():
         axs[0].set_ylabel("CPU Load (%)")
         axs[0].grid(True)
 
-        # Plot Per-CPU Load
-        for ucpu in sorted(cpu_load_per_core_df["ucpu"].unique()):
-            core_data = cpu_load_per_core_df[cpu_load_per_core_df["ucpu"] == ucpu]
-            axs[1].plot(
-                core_data["window_start_ms"],
-                core_data["cpu_load_percentage"],
-                marker="o",
-                linestyle="-",
-                label=f"CPU {ucpu}",
-                markersize=3,
-            )
+        # Plot Per-CPU Load, all cores as a single line collection
+        per_core_load = cpu_load_per_core_df.pivot(
+            index="window_start_ms", columns="ucpu", values="cpu_load_percentage"
+        )
+        window_start_ms = per_core_load.index.to_numpy()
+        loads = per_core_load.to_numpy().T
+        segments = np.stack(
+            [np.broadcast_to(window_start_ms, loads.shape), loads], axis=-1
+        )
+        colors = plt.cm.tab10(np.arange(len(per_core_load.columns)) % 10)
+        axs[1].add_collection(LineCollection(segments, colors=colors))
+        axs[1].scatter(
+            np.broadcast_to(window_start_ms, loads.shape).ravel(),
+            loads.ravel(),
+            c=np.repeat(colors, len(window_start_ms), axis=0),
+            s=9,
+        )
+        axs[1].autoscale()
+        axs[1].legend(
+            handles=[
+                Line2D(
+                    [], [], color=color, marker="o", markersize=3, label=f"CPU {ucpu}"
+                )
+                for ucpu, color in zip(per_core_load.columns, colors)
+            ]
+        )
         axs[1].set_title("Per-CPU Load Over Time")
         axs[1].set_xlabel("Time (ms)")
         axs[1].set_ylabel("CPU Load (%)")
-        axs[1].legend()
         axs[1].grid(True)
 
         plt.tight_layout()
@@ -3,11 +3,10 @@ import time
 import argparse
 import math
 
+import numpy as np
 import pandas as pd
 from perfetto.trace_processor import TraceProcessor, TraceProcessorConfig
 
-from tqdm import tqdm  # Ensure tqdm is installed
-
 # Install c++ plugin with:
 #  python3 -m pip install .
 from cpu_load_plugin import calculate_cpu_load 
@@ -155,14 +154,15 @@ def main():
     # Calculate overall CPU load using sliding window with progress bar
     print("\nCalculating overall CPU load...")
     start = time.time()
-    slice_start_ns_list = df["ts_ns"].tolist()
-    slice_end_ns_list = df["ts_end_ns"].tolist()
-    slice_ucpu_list = df["ucpu"].tolist()
+    # Pass the columns as int64 numpy arrays, the plugin reads them in place
+    slice_start_ns = df["ts_ns"].to_numpy(dtype=np.int64, copy=False)
+    slice_end_ns = df["ts_end_ns"].to_numpy(dtype=np.int64, copy=False)
+    slice_ucpu = df["ucpu"].to_numpy(dtype=np.int64, copy=False)
 
     cpu_load = calculate_cpu_load(
-            slice_start_ns_list,
-            slice_end_ns_list,
-            slice_ucpu_list,
+            slice_start_ns,
+            slice_end_ns,
+            slice_ucpu,
             total_duration_ns,
             window_size_ns,
             window_move_ns,
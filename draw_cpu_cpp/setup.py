@@ -135,6 +135,7 @@ setup(
     ext_modules=[CMakeExtension("cpu_load_plugin")],
     cmdclass={"build_ext": CMakeBuild},
     zip_safe=False,
+    install_requires=["numpy"],
     extras_require={"test": ["pytest>=6.0"]},
     python_requires=">=3.7",
 )
@@ -1,18 +1,13 @@
-#include <atomic>
-#include <queue>
 #include <vector>
 #include <algorithm>
 #include <cstdint>
-#include <memory>
 #include <iostream>
+#include <numeric>
 
 #include <pybind11/pybind11.h>
+#include <pybind11/numpy.h>
 #include <pybind11/stl.h>
 
-#include <mutex>
-#include <condition_variable>
-#include <thread>
-
 #define STRINGIFY(x) #x
 #define MACRO_STRINGIFY(x) STRINGIFY(x)
 
@@ -61,6 +56,11 @@ static void calculate_one_slice(
 
     if(i_start > i_end) return; // No overlapping windows
 
+    // Every window in [i_start, i_end] starts before end_ns and ends after
+    // start_ns, so the overlaps below are always positive and need no clamping.
+    // A slice usually touches only a few windows, so the loop stays scalar and
+    // vectorization is left to -O3 -march=native.
+    float *load = result->data();
     for(int64_t w = i_start; w <= i_end; ++w) {
         int64_t window_start = w * g_detail.window_step_ns;
         int64_t window_end = window_start + g_detail.window_size_ns;
@@ -68,101 +68,32 @@ static void calculate_one_slice(
         // Calculate overlap between [start_ns, end_ns) and [window_start, window_end)
         int64_t overlap_start = std::max(start_ns, window_start);
         int64_t overlap_end = std::min(end_ns, window_end);
-        if(overlap_start >= overlap_end) continue; // No overlap
 
         int64_t overlap = overlap_end - overlap_start;
         // Accumulate load
-        result->at(w) += static_cast<float>(overlap) / g_detail.window_size_ns * 100.0f;
-    }
-}
-
-class Executor {
-public:
-    struct Task {
-        int64_t start_ns;
-        int64_t end_ns;
-    };
-
-    explicit Executor(std::vector<float>* result);
-
-    Executor(const Executor&) = delete;
-    Executor& operator=(const Executor&) = delete;
-    Executor(Executor&&) = delete;
-    Executor& operator=(Executor&&) = delete;
-
-    ~Executor();
-
-    void start();
-    void add_task(Task task);
-    void wait_until_finish();
-private:
-    std::thread m_thread;
-    std::queue<Task> m_tasks;
-    std::mutex m_mutex;
-    std::condition_variable m_condition;
-
-    std::atomic<bool> m_done;
-    std::vector<float>* m_result;
-};
-
-Executor::Executor(std::vector<float>* result): m_done(false), m_result(result) {
-}
-
-Executor::~Executor() {
-    if (!m_done) {
-        wait_until_finish();
-    }
-}
-
-void Executor::start() {
-    m_thread = std::thread([this] {
-        while (true) {
-            Task task;
-            {
-                std::unique_lock<std::mutex> lock(m_mutex);
-                m_condition.wait(lock, [this] { return m_done || !m_tasks.empty(); });
-
-                if (m_done && m_tasks.empty())
-                    break;
-
-                task = m_tasks.front();
-                m_tasks.pop();
-            }
-            calculate_one_slice(task.start_ns, task.end_ns, m_result);
-        }
-    });
-}
-
-void Executor::add_task(Task task) {
-    {
-        std::lock_guard<std::mutex> lock(m_mutex);
-        m_tasks.push(task);
+        load[w] += static_cast<float>(overlap) / g_detail.window_size_ns * 100.0f;
     }
-    m_condition.notify_one();
 }
 
-void Executor::wait_until_finish() {
-    {
-        std::lock_guard<std::mutex> lock(m_mutex);
-        m_done = true;
-    }
-    m_condition.notify_all();
-    if (m_thread.joinable())
-        m_thread.join();
-}
+using Int64Array = py::array_t<int64_t, py::array::c_style | py::array::forcecast>;
 
 std::vector<std::vector<float>> calculate_cpu_load(
-        const std::vector<int64_t> &slice_start_ns,
-        const std::vector<int64_t> &slice_end_ns,
-        const std::vector<int64_t> &ucpu_id,
+        const Int64Array &slice_start_ns,
+        const Int64Array &slice_end_ns,
+        const Int64Array &ucpu_id,
         int64_t trace_duration_ns,
         int64_t window_size_ns,
         int64_t window_step_ns) {
-    if (slice_start_ns.empty() || slice_start_ns.size() != slice_end_ns.size() || slice_start_ns.size() != ucpu_id.size()) {
+    const py::ssize_t num_slices = slice_start_ns.size();
+    if (num_slices == 0 || slice_end_ns.size() != num_slices || ucpu_id.size() != num_slices) {
         return {};
     }
+    // Read the numpy buffers in place instead of copying them into vectors
+    const int64_t *start_ns = slice_start_ns.data();
+    const int64_t *end_ns = slice_end_ns.data();
+    const int64_t *ucpu = ucpu_id.data();
 
-    int64_t max_cpu_id = *std::max_element(ucpu_id.begin(), ucpu_id.end());
+    int64_t max_cpu_id = *std::max_element(ucpu, ucpu + num_slices);
     int64_t num_cpus = max_cpu_id + 1;
     if (max_cpu_id > 32) {
         std::cerr << "Error: CPU ID is too large: " << max_cpu_id << std::endl;
@@ -182,34 +113,41 @@ std::vector<std::vector<float>> calculate_cpu_load(
     g_detail = {trace_duration_ns, window_size_ns, window_step_ns, num_windows};
 
     std::cout << "Going to calculate load for " << num_windows << " windows" << std::endl;
-    std::vector<std::unique_ptr<Executor>> executors;
-    for (int i = 0; i < num_cpus; ++i) {
-        std::unique_ptr<Executor> executor = std::make_unique<Executor>(&result[i]);
-        executor->start();
-        executors.push_back(std::move(executor));
-    }
 
-    for(size_t i = 0; i < slice_start_ns.size(); ++i) {
-        executors[ucpu_id[i]]->add_task(Executor::Task{slice_start_ns[i], slice_end_ns[i]});
-    }
+    // The buffers are plain pointers from here on, let other Python threads run
+    py::gil_scoped_release release;
 
-    // fill up the timestamp column while waiting for the executors to finish
-    for (int64_t w = 0; w < num_windows; ++w) {
-        result[num_cpus + 1][w] = w * window_step_ns;
+    // Bucket slices by cpu (counting sort) so every cpu row is filled by one thread
+    std::vector<int64_t> cpu_offset(num_cpus + 1, 0);
+    for(py::ssize_t i = 0; i < num_slices; ++i) {
+        ++cpu_offset[ucpu[i] + 1];
+    }
+    std::partial_sum(cpu_offset.begin(), cpu_offset.end(), cpu_offset.begin());
+    std::vector<int64_t> cpu_fill(cpu_offset.begin(), cpu_offset.end() - 1);
+    std::vector<int64_t> cpu_slices(num_slices);
+    for(py::ssize_t i = 0; i < num_slices; ++i) {
+        cpu_slices[cpu_fill[ucpu[i]]++] = i;
     }
-    for (auto &executor : executors) {
-        executor->wait_until_finish();
+
+#pragma omp parallel for schedule(dynamic)
+    for (int64_t cpu = 0; cpu < num_cpus; ++cpu) {
+        for (int64_t k = cpu_offset[cpu]; k < cpu_offset[cpu + 1]; ++k) {
+            int64_t i = cpu_slices[k];
+            calculate_one_slice(start_ns[i], end_ns[i], &result[cpu]);
+        }
     }
 
+    float full_window = static_cast<float>(window_size_ns * num_cpus);
+#pragma omp parallel for schedule(static)
     for (int64_t w = 0; w < num_windows; ++w) {
         float accumulated = 0.0f;
         for (int cpu = 0; cpu <= max_cpu_id; ++cpu) {
             // Todo: Not cache friendly
             accumulated += result[cpu][w];
         }
-        float full_window = static_cast<float>(window_size_ns * num_cpus);
         accumulated = std::min(accumulated, full_window);
         result[num_cpus][w] = (accumulated / full_window) * 100.0f;
+        result[num_cpus + 1][w] = w * window_step_ns;
     }
     
     return result;
@@ -1,16 +1,75 @@
-import cmake_example as m
+import numpy as np
+import pytest
+
+import cpu_load_plugin as m
+
+
+def reference_cpu_load(start_ns, end_ns, ucpu, duration, size, step):
+    num_cpus = int(max(ucpu)) + 1
+    num_windows = 1 + (duration - size) // step if duration >= size else 1
+    loads = np.zeros((num_cpus, num_windows))
+    for start, end, cpu in zip(start_ns, end_ns, ucpu):
+        start, end = max(start, 0), min(end, duration)
+        for w in range(num_windows):
+            overlap = min(end, w * step + size) - max(start, w * step)
+            if overlap > 0:
+                loads[cpu, w] += overlap / size * 100
+    full_window = size * num_cpus
+    overall = np.minimum(loads.sum(axis=0), full_window) / full_window * 100
+    timestamps = np.arange(num_windows) * step
+    return np.vstack([loads, overall, timestamps])
 
 
 def test_main():
-    trace_start_ns = [0, 88, 112, 150]
-    trace_end_ns = [110, 180, 200, 180]
-    ucpu = [0, 1, 2, 3]
+    trace_start_ns = np.array([0, 88, 112, 150], dtype=np.int64)
+    trace_end_ns = np.array([110, 180, 200, 180], dtype=np.int64)
+    ucpu = np.array([0, 1, 2, 3], dtype=np.int64)
     trace_duration = 200
     window_size = 100
     window_step = 10
 
     res = m.calculate_cpu_load(trace_start_ns, trace_end_ns, ucpu, trace_duration, window_size, window_step)
-    print(res)
+    assert len(res) == 6
+    assert res[0] == pytest.approx([100, 100, 90, 80, 70, 60, 50, 40, 30, 20, 10])
+    assert res[1] == pytest.approx([12, 22, 32, 42, 52, 62, 72, 82, 92, 90, 80])
+    assert res[2] == pytest.approx([0, 0, 8, 18, 28, 38, 48, 58, 68, 78, 88])
+    assert res[3] == pytest.approx([0, 0, 0, 0, 0, 0, 10, 20, 30, 30, 30])
+    assert res[4] == pytest.approx([28.0, 30.5, 32.5, 35.0, 37.5, 40.0, 45.0, 50.0, 55.0, 54.5, 52.0])
+    assert res[5] == pytest.approx([0, 10, 20, 30, 40, 50, 60, 70, 80, 90, 100])
+
+
+def test_shared_cpu_shuffled():
+    # Several slices per cpu, interleaved so the per-cpu bucketing has to regroup them
+    trace_start_ns = np.array([150, 0, 60, 120, 20, 0, 90, 170], dtype=np.int64)
+    trace_end_ns = np.array([190, 40, 100, 160, 50, 200, 110, 200], dtype=np.int64)
+    ucpu = np.array([1, 0, 0, 1, 1, 2, 0, 0], dtype=np.int64)
+    trace_duration = 200
+    window_size = 100
+    window_step = 50
+
+    res = m.calculate_cpu_load(trace_start_ns, trace_end_ns, ucpu, trace_duration, window_size, window_step)
+    assert len(res) == 5
+    assert res[0] == pytest.approx([90, 60, 40])
+    assert res[1] == pytest.approx([30, 30, 80])
+    assert res[2] == pytest.approx([100, 100, 100])
+    assert res[3] == pytest.approx([220 / 3, 190 / 3, 220 / 3])
+    assert res[4] == pytest.approx([0, 50, 100])
+
+
+# A step much smaller than the window makes every slice span many windows,
+# a step equal to the window leaves only one or two windows per slice
+@pytest.mark.parametrize("window_step", [3, 10, 100])
+def test_matches_reference(window_step):
+    rng = np.random.default_rng(window_step)
+    trace_duration = 10_000
+    window_size = 100
+    trace_start_ns = rng.integers(-50, trace_duration, 500, dtype=np.int64)
+    trace_end_ns = trace_start_ns + rng.integers(1, 400, 500, dtype=np.int64)
+    ucpu = rng.integers(0, 8, 500, dtype=np.int64)
+
+    res = m.calculate_cpu_load(trace_start_ns, trace_end_ns, ucpu, trace_duration, window_size, window_step)
+    expected = reference_cpu_load(trace_start_ns, trace_end_ns, ucpu, trace_duration, window_size, window_step)
+    assert np.asarray(res) == pytest.approx(expected, rel=1e-5, abs=1e-3)
 
 
 if __name__ == "__main__":
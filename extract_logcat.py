@@ -1,7 +1,10 @@
 import os
 import argparse
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
 from perfetto.trace_processor import TraceProcessor, TraceProcessorConfig
 
 log_priority = {
@@ -16,13 +19,36 @@ log_priority = {
     8: ['S', 'ANDROID_LOG_SILENT']
 }
 
-def write_logcat(df, log_path):
-    # add a colomn for log priority string
-    df['prio_str'] = df['prio'].apply(lambda x: log_priority[x][0])
+def join_columns(*columns, sep):
+    return pc.binary_join_element_wise(
+        *columns, pa.scalar(sep, pa.large_string()), null_handling='replace'
+    )
+
 
-    with open(log_path, 'w') as f:
-        for _, row in df.iterrows():
-            f.write(f"{row['ts']} {row['prio_str']}/{row['tag']}: {row['msg']}\n")
+def write_logcat(df, log_path):
+    # format every line with Arrow string kernels, no Python string per row
+    prio_lookup = pa.array(
+        [log_priority[prio][0] for prio in sorted(log_priority)], pa.large_string()
+    )
+    ts = pc.cast(pa.array(df['ts']), pa.large_string())
+    prio_str = pc.take(prio_lookup, pa.array(df['prio'].to_numpy(np.int64)))
+    tag = pa.array(df['tag'].fillna('').astype(str), pa.large_string())
+    msg = pa.array(df['msg'].fillna('').astype(str), pa.large_string())
+
+    lines = join_columns(
+        join_columns(join_columns(ts, prio_str, sep=' '), tag, sep='/'),
+        msg,
+        sep=': ',
+    )
+    log = pc.binary_join(
+        pa.ListArray.from_arrays([0, len(lines)], lines),
+        pa.scalar('\n', pa.large_string()),
+    )[0]
+
+    with open(log_path, 'wb') as f:
+        if len(lines):
+            f.write(log.as_buffer())
+            f.write(b'\n')
 
     print(f"Logcat written to {log_path}")
 
@@ -3,4 +3,4 @@ SELECT
     (ts - trace_start() + dur) as ts_end_ns,
     ucpu
 FROM thread_state 
-WHERE state = 'Running'
+WHERE state = 'Running' AND dur > 0
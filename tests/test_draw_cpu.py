@@ -0,0 +1,172 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pd = pytest.importorskip("pandas")
+pytest.importorskip("pyarrow")
+pytest.importorskip("perfetto")
+pytest.importorskip("tqdm")
+
+import draw_cpu
+
+
+@pytest.mark.parametrize("per_core", [False, True])
+def test_short_trace_has_no_windows(per_core):
+    # ~250 ms trace with 100 ms windows leaves no window once the last 4 are dropped
+    df = pd.DataFrame(
+        {
+            "ts_ns": [0, 50_000_000, 100_000_000],
+            "ts_end_ns": [120_000_000, 250_000_000, 180_000_000],
+            "ucpu": [0, 1, 0],
+        }
+    )
+
+    res = draw_cpu.calculate_cpu_load_sliding_window_base(
+        df, 100_000_000, 100_000_000, num_cpus=2, per_core=per_core
+    )
+
+    assert res.empty
+    expected_columns = ["window_start_ms", "cpu_load_percentage"]
+    if per_core:
+        expected_columns.insert(1, "ucpu")
+    assert list(res.columns) == expected_columns
+
+
+def test_slices_without_cpu_are_rejected():
+    df = pd.DataFrame(
+        {
+            "ts_ns": [0, 50_000_000],
+            "ts_end_ns": [120_000_000, 250_000_000],
+            "ucpu": [0, None],
+        }
+    )
+
+    with pytest.raises(ValueError, match="without a CPU"):
+        draw_cpu.calculate_cpu_load_sliding_window_base(
+            df, 10_000_000, 10_000_000, per_core=True
+        )
+
+
+# Window size 100 ns moved by 50 ns over a 500 ns trace leaves 5 windows:
+# [0, 100), [50, 150), [100, 200), [150, 250), [200, 300)
+LOAD_SLICES = pd.DataFrame(
+    {
+        "ts_ns": [0, 40, 210, 260, 90, 480],
+        "ts_end_ns": [60, 130, 210, 240, 210, 500],
+        "ucpu": [0, 0, 0, 0, 1, 1],
+    }
+)
+# cpu 0 has two overlapping slices (capped at 100%) and two empty ones,
+# cpu 1 has a slice straddling the edges of every window it touches
+CPU0_LOAD = [100.0, 90.0, 30.0, 0.0, 0.0]
+CPU1_LOAD = [10.0, 60.0, 100.0, 60.0, 10.0]
+WINDOW_START_MS = [0.0, 0.00005, 0.0001, 0.00015, 0.0002]
+
+
+def test_overall_load():
+    res = draw_cpu.calculate_cpu_load_sliding_window_base(
+        LOAD_SLICES, 100, 50, num_cpus=2
+    )
+
+    expected = pd.DataFrame(
+        {
+            "window_start_ms": WINDOW_START_MS,
+            "cpu_load_percentage": [65.0, 75.0, 65.0, 30.0, 5.0],
+        }
+    )
+    pd.testing.assert_frame_equal(res, expected)
+
+
+def test_per_core_load():
+    res = draw_cpu.calculate_cpu_load_sliding_window_base(
+        LOAD_SLICES, 100, 50, per_core=True
+    )
+
+    expected = pd.DataFrame(
+        {
+            "window_start_ms": WINDOW_START_MS * 2,
+            "ucpu": [0] * 5 + [1] * 5,
+            "cpu_load_percentage": CPU0_LOAD + CPU1_LOAD,
+        }
+    )
+    pd.testing.assert_frame_equal(res, expected)
+
+
+def reference_load(df, num_windows, window_size_ns, window_move_ns, num_cpus):
+    # Brute force: clip every slice to every window, as the original per-window loop did
+    ts = df["ts_ns"].to_numpy()
+    te = df["ts_end_ns"].to_numpy()
+    loads = []
+    for w in range(num_windows):
+        start_ns = w * window_move_ns
+        end_ns = start_ns + window_size_ns
+        overlap = np.minimum(te, end_ns) - np.maximum(ts, start_ns)
+        running_ns = overlap.clip(min=0).sum()
+        loads.append(min(running_ns / (num_cpus * window_size_ns) * 100, 100.0))
+    return loads
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_matches_reference(seed):
+    rng = np.random.default_rng(seed)
+    ts = rng.integers(0, 1_000_000, 300)
+    df = pd.DataFrame(
+        {
+            "ts_ns": ts,
+            "ts_end_ns": ts + rng.integers(-1_000, 20_000, 300),
+            "ucpu": rng.integers(0, 4, 300),
+        }
+    )
+
+    # Same window count as the code under test, the last 4 windows are dropped
+    duration_ns = df["ts_end_ns"].max() - df["ts_ns"].min()
+    num_windows = -(-(duration_ns - 7_000) // 3_000) + 1 - 4
+
+    overall = draw_cpu.calculate_cpu_load_sliding_window_base(
+        df, 7_000, 3_000, num_cpus=4
+    )
+    assert overall["cpu_load_percentage"].tolist() == pytest.approx(
+        reference_load(df, num_windows, 7_000, 3_000, 4)
+    )
+
+    per_core = draw_cpu.calculate_cpu_load_sliding_window_base(
+        df, 7_000, 3_000, per_core=True
+    )
+    assert per_core["ucpu"].nunique() == 4
+    for ucpu, cpu_df in per_core.groupby("ucpu"):
+        assert cpu_df["cpu_load_percentage"].tolist() == pytest.approx(
+            reference_load(df[df["ucpu"] == ucpu], num_windows, 7_000, 3_000, 1)
+        )
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_overall_from_per_core(seed):
+    # A core runs one slice at a time, so every core stays at or below 100%
+    rng = np.random.default_rng(seed)
+    gaps = rng.integers(0, 5_000, (4, 100))
+    durs = rng.integers(1, 5_000, (4, 100))
+    ts = np.cumsum(gaps + durs, axis=1) - durs
+    df = pd.DataFrame(
+        {
+            "ts_ns": ts.ravel(),
+            "ts_end_ns": (ts + durs).ravel(),
+            "ucpu": np.repeat(np.arange(4), 100),
+        }
+    )
+
+    per_core = draw_cpu.calculate_cpu_load_sliding_window_base(
+        df, 7_000, 3_000, per_core=True
+    )
+    overall = draw_cpu.calculate_cpu_load_sliding_window_base(
+        df, 7_000, 3_000, num_cpus=4
+    )
+    pd.testing.assert_frame_equal(draw_cpu.overall_cpu_load(per_core, 4), overall)
+
+
+def test_overall_from_per_core_needs_capped_cores():
+    # cpu 0 of LOAD_SLICES runs 120% in the first window, which per-core caps
+    per_core = draw_cpu.calculate_cpu_load_sliding_window_base(
+        LOAD_SLICES, 100, 50, per_core=True
+    )
+
+    res = draw_cpu.overall_cpu_load(per_core, 2)
+    assert res["cpu_load_percentage"].tolist() == [55.0, 75.0, 65.0, 30.0, 5.0]
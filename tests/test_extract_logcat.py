@@ -0,0 +1,44 @@
+import pytest
+
+pd = pytest.importorskip("pandas")
+pytest.importorskip("pyarrow")
+pytest.importorskip("perfetto")
+
+import extract_logcat
+
+
+def logcat_frame(rows):
+    # as_pandas_dataframe() returns every column with object dtype
+    return pd.DataFrame(rows, columns=["ts", "prio", "tag", "msg"], dtype=object)
+
+
+def test_write_logcat(tmp_path):
+    df = logcat_frame(
+        [
+            [1000, 4, "ActivityManager", "Start proc"],
+            [1001, 6, None, "no tag"],
+            [1002, 3, "Zygote", None],
+            [1003, 2, None, None],
+            [1004, 5, "Choreographer", float("nan")],
+        ]
+    )
+    log_path = tmp_path / "logcat.txt"
+
+    extract_logcat.write_logcat(df, log_path)
+
+    # Null tags and messages print as empty text, they used to print as "None" or "nan"
+    assert log_path.read_text() == (
+        "1000 I/ActivityManager: Start proc\n"
+        "1001 E/: no tag\n"
+        "1002 D/Zygote: \n"
+        "1003 V/: \n"
+        "1004 W/Choreographer: \n"
+    )
+
+
+def test_write_empty_logcat(tmp_path):
+    log_path = tmp_path / "logcat.txt"
+
+    extract_logcat.write_logcat(logcat_frame([]), log_path)
+
+    assert log_path.read_text() == ""